@@ -1,21 +1,288 @@
 import argparse
 import asyncio
+import collections
+import json
 import logging
 import datetime
-import toml
-from nimiqclient import *
+import sys
+import aiofiles
+from nimiqclient import NimiqClient
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 DEFAULT_LOG_LEVEL = "INFO"
+MAX_CONCURRENT_RPCS = 32
+# Minimum stake (in Luna) enforced on every dumped staker
+MIN_STAKE = 10_000_000
+
+# TOML fields of every account type, keyed by the account type as
+# reported by the RPC. Each field is a (column name, extractor) pair;
+# dispatching through this dict keeps the hot classification loop to a
+# single lookup per account instead of an if/elif chain, and the
+# extracted values are stored as per-column lists rather than one dict
+# per account.
+ACCOUNT_FIELDS = {
+    'htlc': (('address', lambda account: account.address),
+             ('sender', lambda account: account.sender),
+             ('recepient', lambda account: account.receipient),
+             ('balance', lambda account: account.balance),
+             ('hash_root', lambda account: account.hashRoot),
+             ('hash_count', lambda account: account.hashCount),
+             ('timeout', lambda account: account.timeout),
+             ('total_acount', lambda account: account.totalAmount)),
+    'vesting': (('address', lambda account: account.address),
+                ('owner', lambda account: account.owner),
+                ('balance', lambda account: account.balance),
+                ('start_time', lambda account: account.startTime),
+                ('time_step', lambda account: account.timeStep),
+                ('step_amount', lambda account: account.stepAmount),
+                ('total_amount', lambda account: account.totalAmount)),
+    'basic': (('address', lambda account: account.address),
+              ('balance', lambda account: account.balance)),
+}
+
+# TOML array-of-tables name of every account type
+ACCOUNT_TABLES = {
+    'basic': 'basic_accounts',
+    'vesting': 'vesting_accounts',
+    'htlc': 'htlc_accounts',
+}
+
+# Precomputed TOML row templates. The genesis schema is fully known and
+# flat, so each table row is formatted with a ready-made template
+# instead of letting a generic serializer re-discover the field names
+# and types for every value. The account templates take the columns
+# positionally, in ACCOUNT_FIELDS order.
+ACCOUNT_TEMPLATES = {
+    'basic': ('[[basic_accounts]]\n'
+              'address = "{}"\n'
+              'balance = {}\n\n'),
+    'vesting': ('[[vesting_accounts]]\n'
+                'address = "{}"\n'
+                'owner = "{}"\n'
+                'balance = {}\n'
+                'start_time = {}\n'
+                'time_step = {}\n'
+                'step_amount = {}\n'
+                'total_amount = {}\n\n'),
+    'htlc': ('[[htlc_accounts]]\n'
+             'address = "{}"\n'
+             'sender = "{}"\n'
+             'recepient = "{}"\n'
+             'balance = {}\n'
+             'hash_root = "{}"\n'
+             'hash_count = {}\n'
+             'timeout = {}\n'
+             'total_acount = {}\n\n'),
+}
+VALIDATOR_TEMPLATE = ('[[validators]]\n'
+                      'validator_address = "{}"\n'
+                      'signing_key = "{}"\n'
+                      'voting_key = "{}"\n'
+                      'reward_address = "{}"\n'
+                      'inactive_from = {}\n'
+                      'retired = {}\n'
+                      'jailed_from = {}\n\n')
+STAKER_TEMPLATE = ('[[stakers]]\n'
+                   'staker_address = "{}"\n'
+                   'balance = {}\n'
+                   'delegation = "{}"\n'
+                   'inactive_balance = {}\n'
+                   'inactive_from = {}\n\n')
+
+# Lightweight row records for the validator and staker tables. Tuples
+# are a fraction of the size of an equivalent dict per row, which
+# matters once there are thousands of stakers. The field order matches
+# the row templates above.
+ValidatorRow = collections.namedtuple(
+    'ValidatorRow', ['validator_address', 'signing_key', 'voting_key',
+                     'reward_address', 'inactive_from', 'retired',
+                     'jailed_from'])
+StakerRow = collections.namedtuple(
+    'StakerRow', ['staker_address', 'balance', 'delegation',
+                  'inactive_balance', 'inactive_from'])
+
+# Genesis header fields that are emitted as TOML strings, in output
+# order. `block_number` is emitted separately as an integer.
+GENESIS_STRING_FIELDS = ('name', 'network', 'timestamp', 'vrf_seed',
+                         'parent_hash', 'history_root',
+                         'parent_election_hash')
+
+
+def install_orjson():
+    """
+    Swap the Nimiq client's JSON codec for orjson when available.
+
+    The account query responses can be several megabytes of JSON;
+    orjson parses large arrays of objects ~2-3x faster than the stdlib
+    codec and accepts bytes directly, skipping a redundant UTF-8 decode
+    of each WebSocket frame. The pinned nimiqclient has no codec hook,
+    so every client module that uses the stdlib `json` module is
+    patched in place; if orjson is not installed this is a no-op.
+    """
+    if orjson is None:
+        return
+
+    class OrjsonCodec:
+        loads = staticmethod(orjson.loads)
+
+        @staticmethod
+        def dumps(obj, *args, **kwargs):
+            return orjson.dumps(obj).decode()
+
+    for name, module in list(sys.modules.items()):
+        if (name == "nimiqclient" or name.startswith("nimiqclient.")) \
+                and getattr(module, "json", None) is json:
+            module.json = OrjsonCodec
+
+
+def toml_value(value):
+    """
+    Format a single scalar value as a TOML value.
+
+    :params value: The value to format.
+    :type value: str, bool or int
+    :return The TOML representation of the value.
+    :rtype: str
+    """
+    if isinstance(value, str):
+        return f'"{value}"'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def dump_aot(template, columns):
+    """
+    Serialize a TOML array of tables directly from its column lists.
+
+    :params template: The precomputed row template, taking the columns
+        positionally.
+    :type template: str
+    :params columns: The table columns, keyed by column name. All the
+        columns must have the same length.
+    :type columns: dict
+    :return The serialized TOML array of tables.
+    :rtype: str
+    """
+    return "".join(
+        template.format(*row) for row in zip(*columns.values()))
+
+
+def emit_genesis(toml_output, account_columns):
+    """
+    Serialize the genesis document to TOML.
+
+    The emitter is specialized for the genesis schema: the header
+    scalars and the table rows are formatted through precomputed
+    templates, skipping the per-value type dispatch a generic TOML
+    serializer would do.
+
+    :params toml_output: The genesis header fields plus the optional
+        `validators` and `stakers` tables.
+    :type toml_output: dict
+    :params account_columns: The account column lists, keyed by account
+        type.
+    :type account_columns: dict
+    :return The serialized TOML document.
+    :rtype: str
+    """
+    parts = []
+    for field in GENESIS_STRING_FIELDS:
+        parts.append(f'{field} = "{toml_output[field]}"\n')
+    parts.append(f"block_number = {toml_output['block_number']}\n\n")
+    for account_type in ACCOUNT_TABLES:
+        columns = account_columns[account_type]
+        if next(iter(columns.values())):
+            parts.append(
+                dump_aot(ACCOUNT_TEMPLATES[account_type], columns))
+    for table, template in (('validators', VALIDATOR_TEMPLATE),
+                            ('stakers', STAKER_TEMPLATE)):
+        for row in toml_output.get(table, ()):
+            parts.append(template.format(*row))
+    return "".join(parts)
+
+
+def classify_accounts(accounts, account_columns):
+    """
+    Classify a chunk of accounts into the per-type column lists.
+
+    The helper appends to the columns it is given, so it can be called
+    repeatedly on consecutive chunks (e.g. from a paginated account
+    query) instead of requiring the whole account set at once.
+
+    :params accounts: The accounts to classify.
+    :type accounts: list
+    :params account_columns: The account column lists to append to,
+        keyed by account type.
+    :type account_columns: dict
+    """
+    # Pre-size every column to the worst case (all accounts of one
+    # type) so the hot loop stores by index and never triggers list
+    # growth reallocations; the unused tails are truncated at the end.
+    # The column/extract pairs of every account type are bound once, so
+    # each account only costs one type lookup plus one call pair per
+    # field instead of re-resolving the column dict and list methods.
+    n = len(accounts)
+    ops = {}
+    counts = {}
+    for account_type, fields in ACCOUNT_FIELDS.items():
+        columns = [account_columns[account_type][name]
+                   for name, _ in fields]
+        counts[account_type] = len(columns[0])
+        for column in columns:
+            column.extend([None] * n)
+        ops[account_type] = tuple(
+            (column, extract)
+            for column, (_, extract) in zip(columns, fields))
+    get_ops = ops.get
+    debug = logging.debug
+    for account in accounts:
+        type_ops = get_ops(account.type)
+        if type_ops is not None:
+            index = counts[account.type]
+            counts[account.type] = index + 1
+            for column, extract in type_ops:
+                column[index] = extract(account)
+        else:
+            debug("Ignoring account of type %s", account.type)
+    for account_type, count in counts.items():
+        for column in account_columns[account_type].values():
+            del column[count:]
+
+
+async def batch_get_stakers(client, addresses):
+    """
+    Fetch the stakers of a batch of validator addresses in one shot.
+
+    The individual queries are pipelined over the WebSocket connection,
+    bounded to `MAX_CONCURRENT_RPCS` in-flight requests, so the whole
+    batch costs roughly one round-trip instead of one per address.
 
+    :params client: The Nimiq client to query the stakers from.
+    :type client: NimiqClient
+    :params addresses: The validator addresses to fetch the stakers of.
+    :type addresses: list
+    :return The staker query results, in the same order as `addresses`.
+    :rtype: list
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_RPCS)
 
-class Range(object):
-    def __init__(self, start, end):
-        self.start = start
-        self.end = end
+    async def get_stakers(address):
+        async with semaphore:
+            return await client.get_stakers_by_validator_address(address)
 
-    def __eq__(self, other):
-        return self.start <= other <= self.end
+    return await asyncio.gather(
+        *(get_stakers(address) for address in addresses))
 
 
 async def run_client(host, port, vrf, parent_hash, parent_election_hash,
@@ -23,114 +290,92 @@ async def run_client(host, port, vrf, parent_hash, parent_election_hash,
     async with NimiqClient(
         scheme="ws", host=host, port=port
     ) as client:
-        file = open(file_path, "w")
-
-        # Get the chain data
-        block = await client.get_latest_block()
-        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        # Get the chain data, accounts and validators. The three queries
+        # are independent, so they are issued concurrently and only one
+        # round-trip worth of latency is paid for all of them.
+        block, accounts, validators = await asyncio.gather(
+            client.get_latest_block(),
+            client.get_accounts(),
+            client.get_validators())
+        timestamp = datetime.datetime.now(
+            datetime.timezone.utc).isoformat()
 
         logging.info(
-            f"Running for block number: {block.number}, block hash: "
-            f"{block.hash}")
-
-        # Get accounts and validators
-        accounts = await client.get_accounts()
-        validators = await client.get_validators()
+            "Running for block number: %s, block hash: %s",
+            block.number, block.hash)
 
         toml_output = dict()
 
         # Parse the accounts objects to arrays of dictionaries with the
         # expected TOML data
-        parsed_basic_accounts = []
-        parsed_htlcs = []
-        parsed_vesting = []
-        for account in accounts.data:
-            if account.type == 'htlc':
-                parsed_htlcs.append({'address': account.address,
-                                     'sender': account.sender,
-                                     'recepient': account.receipient,
-                                     'balance': account.balance,
-                                     'hash_root': account.hashRoot,
-                                     'hash_count': account.hashCount,
-                                     'timeout': account.timeout,
-                                     'total_acount': account.totalAmount})
-
-            elif account.type == 'vesting':
-                parsed_vesting.append({'address': account.address,
-                                       'owner': account.owner,
-                                       'balance': account.balance,
-                                       'start_time': account.startTime,
-                                       'time_step': account.timeStep,
-                                       'step_amount': account.stepAmount,
-                                       'total_amount': account.totalAmount})
-            elif account.type == 'basic':
-                parsed_basic_accounts.append({
-                    'address': account.address,
-                    'balance': account.balance,
-                })
-            else:
-                logging.debug(f"Ignoring account of type {account.type}")
+        account_columns = {
+            account_type: {name: [] for name, _ in fields}
+            for account_type, fields in ACCOUNT_FIELDS.items()}
+        classify_accounts(accounts.data, account_columns)
 
         # Parse the validator objects to arrays of dictionaries with the
         # expected TOML data
         parsed_validators = []
         parsed_stakers = []
         for validator in validators.data:
-            stakers = await client.get_stakers_by_validator_address(
-                validator.address)
-            parsed_validators.append(
-                {'validator_address': validator.address,
-                 'signing_key': validator.signingKey,
-                 'voting_key': validator.votingKey,
-                 'reward_address': validator.rewardAddress,
-                 'inactive_from': validator.inactivityFlag,
-                 'retired': validator.retired,
-                 'jailed_from': validator.jailedFrom,
-                 })
+            parsed_validators.append(ValidatorRow(
+                validator_address=validator.address,
+                signing_key=validator.signingKey,
+                voting_key=validator.votingKey,
+                reward_address=validator.rewardAddress,
+                inactive_from=validator.inactivityFlag,
+                # Preformatted so the emit template can inline it
+                retired=toml_value(validator.retired),
+                jailed_from=validator.jailedFrom))
             logging.info(
-                f"Found validator, address: {validator.address}, balance: "
-                f"{validator.balance}")
+                "Found validator, address: %s, balance: %s",
+                validator.address, validator.balance)
+
+        # Fetch the stakers of all validators as a single batch
+        stakers_results = await batch_get_stakers(
+            client, [validator.address for validator in validators.data])
+        for stakers in stakers_results:
             for staker in stakers.data:
-                # Enforce minimum stake
-                if staker.balance < 10000000:
-                    staker.balance = 10000000
-                parsed_stakers.append(
-                    {'staker_address': staker.address,
-                     'balance': staker.balance,
-                     'delegation': staker.delegation,
-                     'inactive_balance': staker.inactiveBalance,
-                     'inactive_from': staker.inactiveFrom})
+                parsed_stakers.append(StakerRow(
+                    staker_address=staker.address,
+                    # Enforce minimum stake
+                    balance=max(staker.balance, MIN_STAKE),
+                    delegation=staker.delegation,
+                    inactive_balance=staker.inactiveBalance,
+                    inactive_from=staker.inactiveFrom))
 
         # Now build a dictionary for taking it to TOML
         toml_output['name'] = 'test-albatross'
         toml_output['network'] = 'TestAlbatross'
-        toml_output['timestamp'] = timestamp.isoformat()
+        toml_output['timestamp'] = timestamp
         toml_output['vrf_seed'] = vrf
         toml_output['parent_hash'] = parent_hash
         toml_output['history_root'] = history_root
         toml_output['parent_election_hash'] = parent_election_hash
         toml_output['block_number'] = block_number
-        if len(parsed_basic_accounts) != 0:
-            toml_output['basic_accounts'] = parsed_basic_accounts
-        if len(parsed_vesting) != 0:
-            toml_output['vesting_accounts'] = parsed_vesting
-        if len(parsed_htlcs) != 0:
-            toml_output['htlc_accounts'] = parsed_htlcs
         if len(parsed_validators) != 0:
             toml_output['validators'] = parsed_validators
         if len(parsed_stakers) != 0:
             toml_output['stakers'] = parsed_stakers
 
-        file.write("\n")
-        file.write(
-            f"# File generated at {timestamp.isoformat()} ")
-        file.write("from Nimiq Pos chain\n")
-        file.write(f"# - Block height: {block.number}\n")
-        file.write(f"# - Block hash: {block.hash}\n\n")
+        # Serialize the whole document in memory and write it in a single
+        # shot, so the event loop is not blocked by the many small writes
+        # that toml.dump would issue against the file
+        header = (
+            f"\n# File generated at {timestamp} "
+            f"from Nimiq Pos chain\n"
+            f"# - Block height: {block.number}\n"
+            f"# - Block hash: {block.hash}\n\n")
 
-        toml.dump(toml_output, file)
-        logging.info(f"Output written at '{file_path}'")
-        file.close()
+        # Serializing a large dump is pure CPU for potentially hundreds
+        # of ms; run it on a worker thread so the event loop stays
+        # responsive
+        document = header + await asyncio.to_thread(
+            emit_genesis, toml_output, account_columns)
+
+        async with aiofiles.open(file_path, "w") as file:
+            await file.write(document)
+        logging.info("Output written at '%s'", file_path)
 
 
 def parse_args():
@@ -198,7 +443,16 @@ def main():
     # Setup logging
     setup_logging(args)
 
-    asyncio.get_event_loop().run_until_complete(
+    # Speed up JSON-RPC response decoding
+    install_orjson()
+
+    # Use the libuv-backed event loop when available: the run is bound
+    # by WebSocket I/O dispatch, which uvloop handles with less
+    # per-await overhead than the default selector loop
+    if uvloop is not None:
+        uvloop.install()
+
+    asyncio.run(
         run_client(args.host, args.port, args.vrf, args.parent, args.election,
                    args.history, args.block, args.file)
     )